@@ -8,9 +8,21 @@
 #    dlb build-all                  # from anywhere in the working tree (with directory of 'dlb' in $PATH)
 #    python3 -m build-all           # in the directory of this file
 #    python3 "$PWD"/build-all.py'   # in the directory of this file
+#
+# Incremental builds: dlb keeps its run-database in '.dlbroot/' and all outputs in 'build/out/'.
+# Both must be real directories in the working tree ('.dlbroot' must not be a symbolic link).
+# Keep them between runs to only redo what has changed; for fast rebuilds, place the working tree
+# on fast local storage (SSD or tmpfs).
+#
+# Environment variables:
+#
+#    DBOR_JOBS     maximum number of compiler or linker processes to run in parallel
+#                  (default: number of CPUs, 1: build one file after the other)
+#    DBOR_COLOR    '1': colored diagnostic output, '0': uncolored (default: colored if stderr is a terminal)
 
 import sys
 import os
+import re
 import collections
 from typing import Iterable, Union
 
@@ -26,10 +38,21 @@ import build.doxypress
 dlb_contrib.exctrace.enable_compact_with_cwd(
     involved_line_limit=3,
     traceback_file='build/out/traceback.log')
-if sys.stderr.isatty():
+# colored output: always if $DBOR_COLOR is '1', never if it is '0', otherwise if stderr is a terminal
+color_mode = os.environ.get('DBOR_COLOR')
+if color_mode == '1' or (color_mode != '0' and sys.stderr.isatty()):
     # assume terminal compliant with ISO/IEC 6429 ("VT-100 compatible")
     dlb.di.set_output_file(dlb_contrib.iso6429.MessageColorator(sys.stderr))
 
+# file names to be matched by the entire regular expression (dlb.fs.Path.iterdir() uses fullmatch())
+HEADER_FILE_NAME_REGEX = re.compile(r'.+\.hpp')
+SOURCE_FILE_NAME_REGEX = re.compile(r'.+\.cpp')
+
+QUOTED_INCLUDE_REGEX = re.compile(rb'^[ \t]*#[ \t]*include[ \t]*"([^"\r\n]+)"', re.MULTILINE)
+
+# maximum number of compiler or linker processes to run in parallel (independent translation units and applications)
+max_parallel_compile_count = max(1, int(os.environ.get('DBOR_JOBS', os.cpu_count() or 1)))
+
 
 class Path(dlb.fs.PosixPath, dlb.fs.WindowsPath, dlb.fs.NoSpacePath):
     pass
@@ -42,6 +65,15 @@ class Compiler(dlb_contrib.gcc.CplusplusCompilerGcc):
         return ['-g']
 
 
+class CachingCompiler(Compiler):
+    # Compiler launched by ccache: 'ccache /abs/path/to/gcc ...' instead of 'gcc ...'.
+    EXECUTABLE = 'ccache'
+
+    def get_compile_arguments(self) -> Iterable[Union[str, dlb.fs.Path, dlb.fs.Path.Native]]:
+        compiler_file = dlb.ex.Context.active.helper[dlb_contrib.gcc.CplusplusCompilerGcc.EXECUTABLE]
+        return [compiler_file] + super().get_compile_arguments()
+
+
 class Linker(dlb_contrib.gcc.CplusplusLinkerGcc):
     pass
 
@@ -54,43 +86,92 @@ class Application(dlb.ex.Tool):
         await context.execute_helper(self.EXECUTABLE)
 
 
-def build_with_definitions(source_directory, test_directory, output_directory, compiler):
+def compile_with_definitions(source_directory, header_files, source_files, output_directory, compiler,
+                             reused_files=frozenset(), reused_output_directory=None):
+    # Start the compilation of each file in *header_files* and *source_files* with *compiler* in the active context.
+    # Return the object files of *source_files*.
+    # The files in *reused_files* are not compiled; their object files in *reused_output_directory* are used instead.
+
     generated_source_directory = output_directory / 'Dbor/Generated/'
     generated_test_directory = output_directory / 'test/generated/'
 
-    with dlb.di.Cluster('compile each .hpp'), dlb.ex.Context():
-        for p in source_directory.iterdir(name_filter=r'.+\.hpp',
-                                          recurse_name_filter='', is_dir=False):
-            compiler(
-                source_files=[p],
-                object_files=[output_directory / p.with_appended_suffix('.ot')],
-                include_search_directories=[source_directory]
-            ).start()
+    include_search_directories = [source_directory]
+    header_object_files = [
+        (reused_output_directory if p in reused_files else output_directory) / p.with_appended_suffix('.ot')
+        for p in header_files
+    ]
+    object_files = [
+        (reused_output_directory if p in reused_files else output_directory) / p.with_appended_suffix('.o')
+        for p in source_files
+    ]
 
-    with dlb.di.Cluster('compile'), dlb.ex.Context():
-        source_files = source_directory.list(
-            name_filter=r'.+\.cpp', recurse_name_filter='', is_dir=False)
-        source_files += test_directory.list(
-            name_filter=r'.+\.cpp', recurse_name_filter='', is_dir=False)
-        compile_results = [
+    for p, o in zip(header_files + source_files, header_object_files + object_files):
+        if p not in reused_files:
             compiler(
                 source_files=[p],
-                object_files=[output_directory / p.with_appended_suffix('.o')],
-                include_search_directories=[source_directory]
+                object_files=[o],
+                include_search_directories=include_search_directories
             ).start()
-            for p in source_files
-        ]
+    if reused_files:
+        dlb.di.inform(f'reuse {len(reused_files)} object file(s) in {reused_output_directory.as_string()!r}')
 
-    with dlb.di.Cluster('link'), dlb.ex.Context():
-        application_file = Linker(
-            object_and_archive_files=[r.object_files[0] for r in compile_results],
-            linked_file=output_directory / 'tester').start().linked_file
+    return object_files
 
-    return application_file
+
+def get_files_independent_of(files, include_search_directories, token: bytes):
+    # Return the set of all files in *files* that neither contain *token* nor include - directly or indirectly,
+    # by '#include "..."' - a file that contains *token*.
+    # An included file is searched for like GCC does: in the directory of the including file first, then in
+    # *include_search_directories*. A file with an include that cannot be found is considered dependent.
+
+    scan_result_by_path = {}
+
+    def scan(path):
+        # Return tuple of a boolean (contains *token*?) and the list of included files (None if not all found).
+        scan_result = scan_result_by_path.get(path)
+        if scan_result is None:
+            with open(path.native, 'rb') as f:
+                content = f.read()
+            included_files = []
+            for m in QUOTED_INCLUDE_REGEX.finditer(content):
+                name = Path(m.group(1).decode())
+                candidates = [path[:-1] / name] + [d / name for d in include_search_directories]
+                included_file = next((c for c in candidates if os.path.isfile(c.native)), None)
+                if included_file is None:
+                    included_files = None
+                    break
+                included_files.append(included_file)
+            scan_result = token in content, included_files
+            scan_result_by_path[path] = scan_result
+        return scan_result
+
+    def is_independent(path):
+        paths_to_scan = [path]
+        scanned_paths = set()
+        while paths_to_scan:
+            p = paths_to_scan.pop()
+            if p not in scanned_paths:
+                scanned_paths.add(p)
+                does_contain, included_files = scan(p)
+                if does_contain or included_files is None:
+                    return False
+                paths_to_scan += included_files
+        return True
+
+    return {p for p in files if is_independent(p)}
 
 
 with dlb.ex.Context():
-    class OptimizingCompiler(Compiler):
+    base_compiler = Compiler
+    if dlb.ex.Context.active.helper.get(CachingCompiler.EXECUTABLE):  # ccache installed?
+        for name in ('HOME', 'CCACHE_DIR'):  # location of cache
+            dlb.ex.Context.active.env.import_from_outer(name, pattern=r'.+', example='/home/user/')
+        # rewrite absolute paths in the working tree to relative ones before hashing
+        dlb.ex.Context.active.env.import_from_outer('CCACHE_BASEDIR', pattern=r'.+', example='/home/user/')
+        dlb.ex.Context.active.env['CCACHE_BASEDIR'] = str(dlb.ex.Context.active.root_path.native)
+        base_compiler = CachingCompiler
+
+    class OptimizingCompiler(base_compiler):
         def get_compile_arguments(self) -> Iterable[Union[str, dlb.fs.Path, dlb.fs.Path.Native]]:
             return super().get_compile_arguments() + ['-O3']
 
@@ -101,25 +182,65 @@ with dlb.ex.Context():
         DEFINITIONS = {'DBOR_HAS_FAST_64BIT_ARITH': 1}
 
     compiler_by_configuration = collections.OrderedDict([
-        ('default', Compiler),
+        ('default', base_compiler),
         ('32b',     Compiler32b),
         ('64b',     Compiler64b)
     ])
 
     source_directory = Path('src/')
+    test_directory = Path('test/')
     output_directory = Path('build/out/')
 
-    for configuration, compiler in compiler_by_configuration.items():
-        with dlb.di.Cluster(f'configuration {configuration!r}'):
-            application_file = build_with_definitions(
-                source_directory=source_directory,
-                test_directory=Path('test/'),
-                output_directory=output_directory / f'c/{configuration}/',
-                compiler=compiler
-            )
-            with dlb.di.Cluster(f'test'):
-                dlb.ex.Context.active.helper[Application.EXECUTABLE] = application_file
-                Application().start(force_redo=True)
+    # list once for all configurations
+    header_files = source_directory.list(name_filter=HEADER_FILE_NAME_REGEX, recurse_name_filter='', is_dir=False)
+    source_files = source_directory.list(name_filter=SOURCE_FILE_NAME_REGEX, recurse_name_filter='', is_dir=False)
+    source_files += test_directory.list(name_filter=SOURCE_FILE_NAME_REGEX, recurse_name_filter='', is_dir=False)
+
+    # object files of these files are the same for all configurations that differ only in the definition of
+    # DBOR_HAS_FAST_64BIT_ARITH
+    macro_independent_files = get_files_independent_of(
+        header_files + source_files, [source_directory], b'DBOR_HAS_FAST_64BIT_ARITH')
+
+    # configuration by configuration whose compiler differs only in the definition of DBOR_HAS_FAST_64BIT_ARITH
+    similar_configuration_by_configuration = {'64b': '32b'}
+
+    output_directory_by_configuration = {c: output_directory / f'c/{c}/' for c in compiler_by_configuration}
+
+    # the configurations are independent of each other (except for reused object files):
+    # compile all, then link all, then test all
+    with dlb.di.Cluster('compile'), dlb.ex.Context(max_parallel_redo_count=max_parallel_compile_count):
+        object_files_by_configuration = {}
+        for configuration, compiler in compiler_by_configuration.items():
+            with dlb.di.Cluster(f'configuration {configuration!r}'):
+                reused_files = frozenset()
+                reused_output_directory = None
+                similar_configuration = similar_configuration_by_configuration.get(configuration)
+                if similar_configuration is not None:
+                    reused_files = macro_independent_files
+                    reused_output_directory = output_directory_by_configuration[similar_configuration]
+
+                object_files_by_configuration[configuration] = compile_with_definitions(
+                    source_directory=source_directory,
+                    header_files=header_files,
+                    source_files=source_files,
+                    output_directory=output_directory_by_configuration[configuration],
+                    compiler=compiler,
+                    reused_files=reused_files,
+                    reused_output_directory=reused_output_directory
+                )
+
+    with dlb.di.Cluster('link'), dlb.ex.Context(max_parallel_redo_count=max_parallel_compile_count):
+        link_result_by_configuration = {
+            configuration: Linker(
+                object_and_archive_files=object_files,
+                linked_file=output_directory_by_configuration[configuration] / 'tester').start()
+            for configuration, object_files in object_files_by_configuration.items()
+        }
+
+    for configuration, link_result in link_result_by_configuration.items():
+        with dlb.di.Cluster(f'test configuration {configuration!r}'):
+            dlb.ex.Context.active.helper[Application.EXECUTABLE] = link_result.linked_file
+            Application().start(force_redo=True)
 
     class DoxyPress(build.doxypress.DoxyPress):
         TEXTUAL_REPLACEMENTS = {'project_version': f'version ?'}  # TODO from Git